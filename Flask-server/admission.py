@@ -0,0 +1,208 @@
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import g, jsonify, request
+
+from stages import stage
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        """Raised when a request cannot be admitted within the wait budget"""
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=4, max_queue=8, queue_timeout=2.0,
+                 memory_budget=512 * 1024 * 1024, retry_after=None):
+        """
+        Bound concurrent work per worker process
+
+        Args:
+            max_in_flight (int): Requests allowed to run at the same time
+            max_queue (int): Requests allowed to wait for a slot
+            queue_timeout (float): Seconds a request may wait before being rejected
+            memory_budget (int): Bytes of estimated decode memory shared by
+                                 in-flight requests
+            retry_after (int): Seconds sent in the Retry-After header
+                               (defaults to the queue timeout, rounded up)
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.memory_budget = memory_budget
+        self.retry_after = retry_after or max(1, math.ceil(queue_timeout))
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.memory_reserved = 0
+        self._cond = threading.Condition()
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected_queue_full': 0,
+            'rejected_timeout': 0,
+            'rejected_memory': 0,
+            'max_queue_depth': 0
+        }
+
+    def _can_admit(self, memory):
+        return (self.in_flight < self.max_in_flight
+                and self.memory_reserved + memory <= self.memory_budget)
+
+    def _reject(self, reason):
+        self.stats[f'rejected_{reason}'] += 1
+        raise AdmissionRejected(reason, self.retry_after)
+
+    def acquire(self, memory=0):
+        """
+        Wait for an in-flight slot and a memory reservation
+
+        Args:
+            memory (int): Estimated bytes this request will hold while decoding
+
+        Returns:
+            int: The reservation to pass to release()
+
+        Raises:
+            AdmissionRejected: If the wait queue is full or the wait times out
+        """
+        # A single oversized request may still run, but only on its own
+        memory = min(memory, self.memory_budget)
+
+        with self._cond:
+            if self.waiting == 0 and self._can_admit(memory):
+                self.in_flight += 1
+                self.memory_reserved += memory
+                self.stats['admitted'] += 1
+                return memory
+
+            if self.waiting >= self.max_queue:
+                self._reject('queue_full')
+
+            self.waiting += 1
+            self.stats['queued'] += 1
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.waiting)
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not self._can_admit(memory):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('timeout')
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            self.memory_reserved += memory
+            self.stats['admitted'] += 1
+            return memory
+
+    def release(self, memory=0):
+        """Return a slot and its memory reservation"""
+        with self._cond:
+            self.in_flight -= 1
+            self.memory_reserved -= memory
+            self._cond.notify_all()
+
+    def reserve(self, memory):
+        """
+        Resize the current request's memory reservation
+
+        Used once the real decode size is known (e.g. from the image header).
+        Growing waits for budget like acquire(); shrinking never waits.
+
+        Args:
+            memory (int): New total bytes for this request
+
+        Raises:
+            AdmissionRejected: If the extra memory is not freed within the queue timeout
+        """
+        ticket = g.admission
+        memory = min(memory, self.memory_budget)
+        extra = memory - ticket['memory']
+
+        with self._cond:
+            if extra > 0:
+                deadline = time.monotonic() + self.queue_timeout
+                while self.memory_reserved + extra > self.memory_budget:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('memory')
+                    self._cond.wait(remaining)
+            self.memory_reserved += extra
+            ticket['memory'] = memory
+            if extra < 0:
+                self._cond.notify_all()
+
+    def detach(self):
+        """
+        Hand the current request's slot and reservation over to background work
+
+        The view's decorator will no longer release it; the caller must call
+        release() with the returned amount when the work finishes.
+
+        Returns:
+            int: The memory reservation to pass to release()
+        """
+        g.admission['detached'] = True
+        return g.admission['memory']
+
+    def rejected_response(self, error):
+        """Build the 429/503 response for an AdmissionRejected error"""
+        response = jsonify({
+            'success': False,
+            'error': 'Server is busy, please retry shortly',
+            'reason': error.reason
+        })
+        response.headers['Retry-After'] = str(error.retry_after)
+        status = 429 if error.reason == 'queue_full' else 503
+        return response, status
+
+    def limit(self, memory_factor=1.0):
+        """
+        Decorator applying admission control to a Flask view
+
+        The check runs before the request body is parsed, so rejected uploads
+        are never buffered. The initial reservation is Content-Length *
+        memory_factor; views can refine it with reserve() once the body is read.
+
+        Args:
+            memory_factor (float): Ratio of memory held to upload size
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                estimate = int((request.content_length or 0) * memory_factor)
+                try:
+                    with stage('admission_wait'):
+                        reserved = self.acquire(estimate)
+                except AdmissionRejected as e:
+                    return self.rejected_response(e)
+
+                g.admission = {'memory': reserved, 'detached': False}
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    if not g.admission['detached']:
+                        self.release(g.admission['memory'])
+            return wrapper
+        return decorator
+
+    def get_stats(self):
+        """Current queue depth, in-flight work and rejection counts"""
+        with self._cond:
+            return dict(
+                self.stats,
+                in_flight=self.in_flight,
+                queue_depth=self.waiting,
+                memory_reserved=self.memory_reserved,
+                max_in_flight=self.max_in_flight,
+                max_queue=self.max_queue,
+                queue_timeout=self.queue_timeout,
+                memory_budget=self.memory_budget
+            )
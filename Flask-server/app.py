@@ -1,193 +1,20 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, g
 import os
+import hmac
+from functools import wraps
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-import PIL.Image
-from PIL import ImageEnhance, ImageFilter
-import json
+import copy
 from datetime import datetime
-from pathlib import Path
 from dotenv import load_dotenv
-import tempfile
+from profiler import RequestProfiler
+from stages import stage
+from admission import AdmissionController, AdmissionRejected
+from progressive import RefinementJobs
+from services import PrescriptionOCR, GeminiTranslator, model_settings_from_env
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Your PrescriptionOCR class
-class PrescriptionOCR:
-    def __init__(self, api_key):
-        """Initialize Prescription OCR with API key"""
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-    
-    def preprocess_image(self, image_path, enhance=True):
-        """Preprocess prescription image for better OCR results"""
-        image = PIL.Image.open(image_path) 
-        
-        if enhance:
-            if image.mode != 'L':
-                image = image.convert('L')
-            
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(2.0)
-            
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(2.0)
-            
-            image = image.filter(ImageFilter.GaussianBlur(radius=0.5))
-        
-        return image
-    
-    def extract_prescription_details(self, image_path, enhance_image=True):
-        """Extract detailed prescription information from doctor's handwriting"""
-        try:
-            if enhance_image:
-                image = self.preprocess_image(image_path)
-            else:
-                image = PIL.Image.open(image_path)
-            
-            prompt = """
-            You are a medical transcription expert. Analyze this prescription image and extract information in JSON format.
-            
-            Return ONLY a valid JSON object with this exact structure:
-            {
-                "doctor": {
-                    "name": "doctor name or null",
-                    "qualifications": "degrees/qualifications or null",
-                    "registration_number": "reg number or null",
-                    "clinic_name": "clinic/hospital name or null",
-                    "address": "clinic address or null",
-                    "phone": "phone number or null"
-                },
-                "patient": {
-                    "name": "patient name or null",
-                    "age": "age or null",
-                    "gender": "gender or null",
-                    "address": "patient address or null",
-                    "prescription_date": "date or null"
-                },
-                "medications": [
-                    {
-                        "name": "medicine name",
-                        "dosage": "strength/dosage",
-                        "quantity": "quantity prescribed",
-                        "frequency": "how often to take",
-                        "duration": "how long to take",
-                        "instructions": "special instructions",
-                        "uncertain": false
-                    }
-                ],
-                "additional_notes": {
-                    "special_instructions": "any special instructions or null",
-                    "follow_up": "follow-up date or instructions or null",
-                    "warnings": "warnings or precautions or null"
-                },
-                "extraction_notes": "any unclear text or reading difficulties"
-            }
-            
-            Rules:
-            
-            1. Use **null** for fields that are absent or unreadable.  
-            2. If any reading is doubtful, copy the raw text into `instructions` and set `"uncertain": true`.
-
-            3. **Interpreting timing codes**
-
-            • `1` or `X`  =  **take**  
-            • `0` or `O`  =  **skip** **unless** the code has **only O-O**, then treat each O as **take**.  
-            • Code length → times:  
-                - 1 slot → once daily  
-                - 2 slots → morning & night  
-                - 3 slots → morning, afternoon, night  
-                - 4 slots → every 6 hours  
-            • Expand the code into clear English in `frequency`, repeating any fractional dose in each phrase.
-
-            4. If brand name is given in prescription, output brand name. Don't convert it to generic drug name.
-                If dosage is mentioned with name, let it be mentioned in the name, besides giving it seperately in the output. For example, if "Rantac 300" is given, output that, not "Rantac" or "Ranitidine".
-            5. Output only the final JSON – no other text, commentary, or markup.
-            """
-            
-            response = self.model.generate_content([prompt, image])
-            
-            # Try to parse the JSON response
-            try:
-                json_data = json.loads(response.text.strip())
-                return {
-                    'success': True,
-                    'data': json_data,
-                    'extraction_date': datetime.now().isoformat(),
-                    'image_path': os.path.basename(image_path)
-                }
-            except json.JSONDecodeError:
-                # If JSON parsing fails, return raw text as fallback
-                return {
-                    'success': True,
-                    'data': {
-                        'raw_response': response.text,
-                        'note': 'Could not parse as JSON, returning raw text'
-                    },
-                    'extraction_date': datetime.now().isoformat(),
-                    'image_path': os.path.basename(image_path)
-                }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': f"Error processing prescription: {str(e)}"
-            }
-
-# GeminiTranslator class
-class GeminiTranslator:
-    def __init__(self, api_key):
-        """Initialize Gemini Translator with API key"""
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-    
-    def translate_text_with_context(self, text, target_language, context_info=""):
-        """
-        Translate text with additional context for better accuracy
-        
-        Args:
-            text (str): Text to translate
-            target_language (str): Target language
-            context_info (str): Additional context (e.g., "medical document", "technical manual")
-        
-        Returns:
-            dict: Translation result with success status and translated text
-        """
-        try:
-            context_prompt = ""
-            if context_info:
-                context_prompt = f"This is a {context_info}. Please translate accordingly with appropriate terminology."
-            
-            prompt = f"""
-            Please translate the following English text to {target_language}.
-            {context_prompt}
-            
-            Maintain the original formatting, paragraph breaks, and style.
-            Provide a natural, fluent translation that preserves the meaning and tone.
-            
-            Text to translate:
-            {text}
-            """
-            
-            response = self.model.generate_content(prompt)
-            translated_text = response.text
-            
-            return {
-                'success': True,
-                'original_text': text,
-                'translated_text': translated_text,
-                'target_language': target_language,
-                'context_info': context_info,
-                'translation_date': datetime.now().isoformat()
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': f"Error in translation: {str(e)}"
-            }
-
 # Flask app setup
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -202,9 +29,55 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it in your .env file.")
 
+# Prompt caching and per-request token budget (see model_settings_from_env)
+MODEL_SETTINGS = model_settings_from_env()
+
 # Initialize OCR and Translator with API key from environment
-ocr = PrescriptionOCR(GEMINI_API_KEY)
-translator = GeminiTranslator(GEMINI_API_KEY)
+ocr = PrescriptionOCR(GEMINI_API_KEY, **MODEL_SETTINGS)
+translator = GeminiTranslator(GEMINI_API_KEY, **MODEL_SETTINGS)
+
+# Progressive extraction: first-pass image size and background refinement workers
+FIRST_PASS_MAX_SIDE = int(os.getenv('FIRST_PASS_MAX_SIDE', '1024'))
+refinements = RefinementJobs(
+    max_workers=int(os.getenv('REFINEMENT_WORKERS', '2')),
+    max_pending=int(os.getenv('REFINEMENT_MAX_PENDING', '8'))
+)
+
+# Opt-in request profiling: sample a fraction of requests, or any request
+# carrying the X-Profile-Token header
+profiler = RequestProfiler(
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+    token=os.getenv('PROFILE_TOKEN'),
+    interval=float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000,
+    output_dir=os.getenv('PROFILE_DIR')
+)
+profiler.init_app(app)
+
+# Admission control for upload-heavy endpoints, sized per worker process
+admission = AdmissionController(
+    max_in_flight=int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '4')),
+    max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', '8')),
+    queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '2')),
+    memory_budget=int(os.getenv('ADMISSION_MEMORY_BUDGET_MB', '512')) * 1024 * 1024
+)
+# Decoded image copies held at once while preprocessing (original + grayscale/filter copies)
+IMAGE_DECODE_COPIES = float(os.getenv('IMAGE_DECODE_COPIES', '2'))
+# Memory held by /api/translate-file relative to the upload (raw bytes + decoded text + prompt)
+TEXT_DECODE_FACTOR = float(os.getenv('TEXT_DECODE_FACTOR', '4'))
+
+# Token for /api/admin/* endpoints; falls back to the profiling token
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN') or os.getenv('PROFILE_TOKEN')
+
+def require_admin(view):
+    """Reject requests to admin endpoints without a valid X-Admin-Token header"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get('X-Admin-Token') or request.headers.get('X-Profile-Token')
+        if not ADMIN_TOKEN or supplied is None or not hmac.compare_digest(
+                supplied.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp'}
@@ -218,14 +91,17 @@ def index():
     return render_template('index.html')
 
 @app.route('/api/extract', methods=['POST'])
+@admission.limit(memory_factor=1.0)
 def extract_prescription():
     """API endpoint to extract prescription details from uploaded image"""
     try:
         # Check if file is in request
-        if 'file' not in request.files:
+        with stage('multipart_parse'):
+            files = request.files
+        if 'file' not in files:
             return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        file = request.files['file']
+        file = files['file']
         
         # Check if file is selected
         if file.filename == '':
@@ -238,25 +114,87 @@ def extract_prescription():
         # Save uploaded file
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        with stage('save_upload'):
+            file.save(filepath)
+        
+        # Reserve the real decode size from the image header before decoding;
+        # a small, highly compressed upload can decode to hundreds of MB
+        decoded_size = ocr.estimate_decoded_size(filepath) * IMAGE_DECODE_COPIES
+        try:
+            with stage('memory_reserve'):
+                admission.reserve(int((request.content_length or 0) + decoded_size))
+        except AdmissionRejected as e:
+            os.remove(filepath)
+            return admission.rejected_response(e)
         
-        # Extract prescription details
-        result = ocr.extract_prescription_details(filepath)
+        progressive = request.values.get('progressive', 'false').lower() in ('1', 'true', 'yes')
         
-        # Clean up uploaded file
-        os.remove(filepath)
+        if progressive:
+            # Fast pass now; uncertain medications are re-read in the background
+            try:
+                image = ocr.load_image(filepath)
+            except Exception as e:
+                # Same failure shape as the single-pass extraction
+                return jsonify({
+                    'success': False,
+                    'error': f"Error processing prescription: {str(e)}"
+                })
+            finally:
+                os.remove(filepath)
+            
+            result = ocr.extract_first_pass(image, filename, max_side=FIRST_PASS_MAX_SIDE)
+            if not result['success'] or 'raw_response' in result['data']:
+                # Without a parsed first pass there are no uncertainty flags to act on
+                result['refinement'] = {'status': 'unavailable'}
+            elif result['uncertain_medications']:
+                # The job holds the full-resolution image, so it keeps this request's
+                # admission slot and memory until it finishes. It gets its own copy
+                # of the result, which is still modified and serialized here.
+                reserved = g.admission['memory']
+                refinement_id = refinements.submit(
+                    ocr.refine_uncertain, image, copy.deepcopy(result),
+                    on_done=lambda: admission.release(reserved)
+                )
+                if refinement_id is None:
+                    result['refinement'] = {'status': 'skipped', 'reason': 'refinement queue full'}
+                else:
+                    admission.detach()
+                    result['refinement'] = {
+                        'status': 'pending',
+                        'id': refinement_id,
+                        'url': f"/api/extract/refinements/{refinement_id}"
+                    }
+            else:
+                result['refinement'] = {'status': 'not_needed'}
+        else:
+            # Extract prescription details
+            result = ocr.extract_prescription_details(filepath)
+            
+            # Clean up uploaded file
+            os.remove(filepath)
         
-        return jsonify(result)
+        with stage('serialize'):
+            return jsonify(result)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/extract/refinements/<refinement_id>', methods=['GET'])
+def get_refinement(refinement_id):
+    """API endpoint to poll the second pass of a progressive extraction"""
+    job = refinements.get(refinement_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Refinement not found'}), 404
+    
+    return jsonify(dict(job, success=job['status'] != 'failed', id=refinement_id))
+
 @app.route('/api/translate', methods=['POST'])
 def translate_text():
     """API endpoint to translate text with context using Gemini"""
     try:
         # Get JSON data from request
-        data = request.get_json()
+        with stage('json_parse'):
+            data = request.get_json()
         
         # Validate required fields
         if not data:
@@ -287,14 +225,17 @@ def translate_text():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/translate-file', methods=['POST'])
+@admission.limit(memory_factor=TEXT_DECODE_FACTOR)
 def translate_file():
     """API endpoint to translate text file with context"""
     try:
         # Check if file is in request
-        if 'file' not in request.files:
+        with stage('multipart_parse'):
+            files = request.files
+        if 'file' not in files:
             return jsonify({'success': False, 'error': 'No file provided'}), 400
         
-        file = request.files['file']
+        file = files['file']
         
         # Check if file is selected
         if file.filename == '':
@@ -342,6 +283,47 @@ def get_supported_languages():
         'total': len(languages)
     })
 
+@app.route('/api/admin/profiles', methods=['GET'])
+@require_admin
+def list_profiles():
+    """Admin endpoint listing recent request profiles and the slowest requests"""
+    return jsonify({
+        'success': True,
+        'profiles': profiler.list_profiles(),
+        'slowest': profiler.list_slowest()
+    })
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@require_admin
+def get_profile(profile_id):
+    """Admin endpoint returning a single profile in collapsed-stack format"""
+    profile = profiler.get_profile(profile_id)
+    if profile is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    
+    return Response(profile['collapsed'] + '\n', mimetype='text/plain')
+
+@app.route('/api/admin/usage', methods=['GET'])
+@require_admin
+def get_token_usage():
+    """Admin endpoint reporting cumulative token usage per prompt version"""
+    return jsonify({
+        'success': True,
+        'token_budget': MODEL_SETTINGS['token_budget'],
+        **ocr.get_totals(),
+        'translation': translator.model.get_totals()
+    })
+
+@app.route('/api/admin/admission', methods=['GET'])
+@require_admin
+def get_admission_stats():
+    """Admin endpoint reporting queue depth and rejection counts for this worker"""
+    return jsonify({
+        'success': True,
+        'admission': admission.get_stats(),
+        'refinements': refinements.get_stats()
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -0,0 +1,175 @@
+import hmac
+import os
+import sys
+import time
+import random
+import threading
+import uuid
+from collections import deque, Counter
+from datetime import datetime
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+# Admin, health-check and static requests are neither sampled nor timed, so
+# polling them can't push real slow requests out of the slowest list
+UNTRACKED_PREFIXES = ('/api/admin/', '/api/health', '/static/')
+
+
+class StackSampler:
+    def __init__(self, thread_id, interval=0.005):
+        """Sample the stack of a single thread at a fixed interval"""
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[';'.join(stack)] += 1
+
+    def collapsed(self):
+        """
+        Render samples in collapsed-stack format
+
+        Returns:
+            str: One "frame;frame;frame count" line per unique stack,
+                 as consumed by flamegraph.pl, speedscope and inferno
+        """
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+class RequestProfiler:
+    def __init__(self, sample_rate=0.0, token=None, interval=0.005, max_profiles=50, max_slow=20,
+                 output_dir=None):
+        """
+        Opt-in request profiler
+
+        Args:
+            sample_rate (float): Fraction of requests to profile (0.0 - 1.0)
+            token (str): Secret that forces profiling when sent in the
+                         X-Profile-Token header
+            interval (float): Seconds between stack samples
+            max_profiles (int): Number of recent profiles kept in memory
+            max_slow (int): Number of slowest requests kept in memory
+            output_dir (str): Optional directory where each profile is also
+                              written as <profile_id>.collapsed
+        """
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.max_slow = max_slow
+        self.profiles = deque(maxlen=max_profiles)
+        self.slowest = []
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def init_app(self, app):
+        """Register request hooks on the Flask app"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def is_authorized(self):
+        """Check whether the current request carries the profiling token"""
+        supplied = request.headers.get(PROFILE_HEADER)
+        if not self.token or supplied is None:
+            return False
+        return hmac.compare_digest(supplied.encode('utf-8'), self.token.encode('utf-8'))
+
+    def _before_request(self):
+        # Leaving profile_start unset also skips recording in _teardown_request
+        if request.path == '/' or request.path.startswith(UNTRACKED_PREFIXES):
+            return
+
+        g.profile_start = time.perf_counter()
+        g.profile_stages = {}
+        g.profile_sampler = None
+        g.profile_status = None
+
+        if self.is_authorized() or (self.sample_rate > 0 and random.random() < self.sample_rate):
+            g.profile_id = uuid.uuid4().hex[:12]
+            g.profile_sampler = StackSampler(threading.get_ident(), self.interval)
+            g.profile_sampler.start()
+
+    def _after_request(self, response):
+        g.profile_status = response.status_code
+        if g.get('profile_sampler') is not None:
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    def _teardown_request(self, exc=None):
+        start = g.get('profile_start')
+        if start is None:
+            return
+        duration_ms = round((time.perf_counter() - start) * 1000, 2)
+
+        entry = {
+            'method': request.method,
+            'path': request.path,
+            'status': g.get('profile_status') or 500,
+            'duration_ms': duration_ms,
+            'stages': g.get('profile_stages') or {},
+            'timestamp': datetime.now().isoformat()
+        }
+
+        sampler = g.get('profile_sampler')
+        if sampler is not None:
+            sampler.stop()
+            entry['profile_id'] = g.profile_id
+            entry['sample_count'] = sum(sampler.samples.values())
+            collapsed = sampler.collapsed()
+            with self._lock:
+                self.profiles.append(dict(entry, collapsed=collapsed))
+
+            if self.output_dir:
+                path = os.path.join(self.output_dir, f"{g.profile_id}.collapsed")
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(collapsed + '\n')
+
+        with self._lock:
+            self.slowest.append(entry)
+            self.slowest.sort(key=lambda e: e['duration_ms'], reverse=True)
+            del self.slowest[self.max_slow:]
+
+    def list_profiles(self):
+        """Summaries of recent profiles, newest first, without stack data"""
+        with self._lock:
+            return [
+                {k: v for k, v in p.items() if k != 'collapsed'}
+                for p in reversed(self.profiles)
+            ]
+
+    def list_slowest(self):
+        """Slowest recorded requests with their stage timings"""
+        with self._lock:
+            return list(self.slowest)
+
+    def get_profile(self, profile_id):
+        """Return a stored profile by id, or None"""
+        with self._lock:
+            for p in self.profiles:
+                if p['profile_id'] == profile_id:
+                    return p
+        return None
@@ -0,0 +1,176 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import PIL.Image
+
+MEDICATION_FIELDS = ('name', 'dosage', 'quantity', 'frequency', 'duration', 'instructions')
+
+
+def downscale_image(image, max_side=1024):
+    """Return a copy of the image whose longest side is at most max_side pixels"""
+    image = image.copy()
+    image.thumbnail((max_side, max_side), PIL.Image.LANCZOS)
+    return image
+
+
+def find_uncertain_medications(data):
+    """
+    Find medications the model flagged as uncertain
+
+    Args:
+        data (dict): Parsed extraction result
+
+    Returns:
+        list: Indexes into data['medications']
+    """
+    if not isinstance(data, dict):
+        return []
+    medications = data.get('medications') or []
+    return [i for i, med in enumerate(medications) if isinstance(med, dict) and med.get('uncertain')]
+
+
+def crop_medication(image, box_2d, pad=0.5):
+    """
+    Crop the region of one medication entry from the full-resolution image
+
+    Args:
+        image (PIL.Image): Full-resolution image
+        box_2d (list): [ymin, xmin, ymax, xmax] normalized to 0-1000
+        pad (float): Extra margin around the box, as a fraction of its height
+
+    Returns:
+        PIL.Image: The cropped region, or None if the box is missing or unusable
+    """
+    try:
+        ymin, xmin, ymax, xmax = [float(v) for v in box_2d]
+    except (TypeError, ValueError):
+        return None
+
+    if ymax <= ymin or xmax <= xmin:
+        return None
+
+    width, height = image.size
+    margin = (ymax - ymin) * pad
+    # Handwritten instructions often run past the detected box, so widen generously
+    left = max(0, int((xmin - margin * 2) / 1000 * width))
+    right = min(width, int((xmax + margin * 2) / 1000 * width))
+    top = max(0, int((ymin - margin) / 1000 * height))
+    bottom = min(height, int((ymax + margin) / 1000 * height))
+    return image.crop((left, top, right, bottom))
+
+
+def merge_refined_medications(data, refined, allowed_indexes):
+    """
+    Merge second-pass readings into the first-pass result
+
+    Args:
+        data (dict): First-pass extraction result (modified in place)
+        refined (list): Medication dicts from the second pass, each with 'index'
+        allowed_indexes (list): Indexes that were sent for refinement; any
+                                other index the model returns is ignored
+
+    Returns:
+        list: Indexes that were updated
+    """
+    medications = data.get('medications') or []
+    allowed = set(allowed_indexes)
+    updated = []
+    for item in refined:
+        if not isinstance(item, dict):
+            continue
+        index = item.get('index')
+        # bool is a subclass of int, so True would otherwise address entry 1
+        if isinstance(index, bool) or not isinstance(index, int):
+            continue
+        if index not in allowed or not 0 <= index < len(medications) or index in updated:
+            continue
+        med = medications[index]
+        for field in MEDICATION_FIELDS:
+            if item.get(field) is not None:
+                med[field] = item[field]
+        med['uncertain'] = bool(item.get('uncertain', False))
+        med['refined'] = True
+        updated.append(index)
+    return updated
+
+
+class RefinementJobs:
+    def __init__(self, max_workers=2, max_pending=8, max_jobs=200):
+        """
+        Background runner for second-pass refinements
+
+        Args:
+            max_workers (int): Number of refinements run concurrently
+            max_pending (int): Running plus queued refinements; further
+                               submissions are refused
+            max_jobs (int): Number of most recent finished jobs kept for polling
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.pending = 0
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, on_done=None):
+        """
+        Run fn(*args) in the background
+
+        Args:
+            fn: Function to run
+            on_done: Optional callback run once the job has finished, either way
+
+        Returns:
+            str: Job id, or None if max_pending jobs are already queued
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+            self.jobs[job_id] = {'status': 'pending', 'submitted': datetime.now().isoformat()}
+            self._evict_finished()
+
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._finish(job_id, f, on_done))
+        return job_id
+
+    def _evict_finished(self):
+        """Drop the oldest finished jobs beyond max_jobs; pending jobs are never dropped"""
+        excess = len(self.jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] != 'pending']
+        for job_id in finished[:excess]:
+            del self.jobs[job_id]
+
+    def _finish(self, job_id, future, on_done=None):
+        try:
+            with self._lock:
+                self.pending -= 1
+                job = self.jobs[job_id]
+                try:
+                    job['result'] = future.result()
+                    job['status'] = 'done'
+                except Exception as e:
+                    job['status'] = 'failed'
+                    job['error'] = str(e)
+                job['completed'] = datetime.now().isoformat()
+                self._evict_finished()
+        finally:
+            if on_done is not None:
+                on_done()
+
+    def get_stats(self):
+        """Pending refinement count and limit"""
+        with self._lock:
+            return {'pending': self.pending, 'max_pending': self.max_pending}
+
+    def get(self, job_id):
+        """Return a copy of the job state, or None"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
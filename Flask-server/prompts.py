@@ -0,0 +1,279 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import caching
+
+# Wait before retrying context cache creation after a transient failure
+CACHE_RETRY_DELAY = timedelta(minutes=1)
+
+EXTRACTION_PROMPT_VERSION = 'extraction-v1'
+EXTRACTION_SYSTEM_INSTRUCTION = """
+You are a medical transcription expert. Analyze the prescription image you are given and extract information in JSON format.
+
+Return ONLY a valid JSON object with this exact structure:
+{
+    "doctor": {
+        "name": "doctor name or null",
+        "qualifications": "degrees/qualifications or null",
+        "registration_number": "reg number or null",
+        "clinic_name": "clinic/hospital name or null",
+        "address": "clinic address or null",
+        "phone": "phone number or null"
+    },
+    "patient": {
+        "name": "patient name or null",
+        "age": "age or null",
+        "gender": "gender or null",
+        "address": "patient address or null",
+        "prescription_date": "date or null"
+    },
+    "medications": [
+        {
+            "name": "medicine name",
+            "dosage": "strength/dosage",
+            "quantity": "quantity prescribed",
+            "frequency": "how often to take",
+            "duration": "how long to take",
+            "instructions": "special instructions",
+            "uncertain": false
+        }
+    ],
+    "additional_notes": {
+        "special_instructions": "any special instructions or null",
+        "follow_up": "follow-up date or instructions or null",
+        "warnings": "warnings or precautions or null"
+    },
+    "extraction_notes": "any unclear text or reading difficulties"
+}
+
+Rules:
+
+1. Use **null** for fields that are absent or unreadable.
+2. If any reading is doubtful, copy the raw text into `instructions` and set `"uncertain": true`.
+
+3. **Interpreting timing codes**
+
+• `1` or `X`  =  **take**
+• `0` or `O`  =  **skip** **unless** the code has **only O-O**, then treat each O as **take**.
+• Code length → times:
+    - 1 slot → once daily
+    - 2 slots → morning & night
+    - 3 slots → morning, afternoon, night
+    - 4 slots → every 6 hours
+• Expand the code into clear English in `frequency`, repeating any fractional dose in each phrase.
+
+4. If brand name is given in prescription, output brand name. Don't convert it to generic drug name.
+    If dosage is mentioned with name, let it be mentioned in the name, besides giving it seperately in the output. For example, if "Rantac 300" is given, output that, not "Rantac" or "Ranitidine".
+5. Output only the final JSON – no other text, commentary, or markup.
+"""
+EXTRACTION_REQUEST = "Extract the prescription details from this image."
+
+# Progressive first pass: same instruction, plus a per-medication region used to
+# crop uncertain entries for the second pass
+PROGRESSIVE_EXTRACTION_PROMPT_VERSION = 'extraction-progressive-v1'
+PROGRESSIVE_EXTRACTION_SYSTEM_INSTRUCTION = EXTRACTION_SYSTEM_INSTRUCTION.replace(
+    '''            "uncertain": false
+''',
+    '''            "uncertain": false,
+            "box_2d": [ymin, xmin, ymax, xmax]
+'''
+).replace(
+    '''and set `"uncertain": true`.
+''',
+    '''and set `"uncertain": true`.
+   `box_2d` is the region of the image containing that medication entry, as integers normalized to 0-1000, or null.
+'''
+)
+
+REFINEMENT_PROMPT_VERSION = 'refinement-v1'
+REFINEMENT_SYSTEM_INSTRUCTION = """
+You are a medical transcription expert re-reading medication entries from a handwritten prescription.
+Each entry is given as a high-resolution crop together with the index and the first-pass reading, which was marked uncertain.
+
+Return ONLY a valid JSON object with this exact structure:
+{
+    "medications": [
+        {
+            "index": 0,
+            "name": "medicine name",
+            "dosage": "strength/dosage",
+            "quantity": "quantity prescribed",
+            "frequency": "how often to take",
+            "duration": "how long to take",
+            "instructions": "special instructions",
+            "uncertain": false
+        }
+    ]
+}
+
+Rules:
+
+1. Return one object per entry, using the index you were given.
+2. Use **null** for fields that are still unreadable, and keep `"uncertain": true` if the reading is still doubtful.
+3. Apply the same timing-code, brand-name and dosage rules as the original transcription.
+4. Output only the final JSON – no other text, commentary, or markup.
+"""
+REFINEMENT_REQUEST = "Re-read these uncertain medication entries."
+
+TRANSLATION_PROMPT_VERSION = 'translation-v1'
+TRANSLATION_SYSTEM_INSTRUCTION = """
+You are a translator. Translate the English text you are given into the requested target language.
+If a document context is given, translate accordingly with appropriate terminology.
+
+Maintain the original formatting, paragraph breaks, and style.
+Provide a natural, fluent translation that preserves the meaning and tone.
+Output only the translated text.
+"""
+
+
+def build_translation_request(text, target_language, context_info=""):
+    """Build the per-call part of the translation prompt"""
+    lines = [f"Target language: {target_language}"]
+    if context_info:
+        lines.append(f"Context: This is a {context_info}.")
+    lines.append("")
+    lines.append("Text to translate:")
+    lines.append(text)
+    return "\n".join(lines)
+
+
+class PromptModel:
+    def __init__(self, model_name, system_instruction, version, use_cache=False,
+                 cache_ttl_minutes=60, token_budget=None, generation_config=None):
+        """
+        Long-lived Gemini model bound to a versioned system instruction
+
+        Args:
+            model_name (str): Gemini model name
+            system_instruction (str): Shared instruction prefix sent with every call
+            version (str): Prompt version reported with each response
+            use_cache (bool): Store the system instruction with Gemini context
+                              caching so it is not re-billed on every call.
+                              Only takes effect for models that support caching
+                              and instructions above their minimum cacheable size
+            cache_ttl_minutes (int): Lifetime of the cached content
+            token_budget (int): Optional per-request total token budget
+            generation_config (dict): Optional generation settings for every call
+        """
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.version = version
+        self.use_cache = use_cache
+        self.cache_ttl = timedelta(minutes=cache_ttl_minutes)
+        self.token_budget = token_budget
+        self.generation_config = generation_config
+
+        self.model = genai.GenerativeModel(
+            model_name,
+            system_instruction=system_instruction,
+            generation_config=generation_config
+        )
+        self._cached_model = None
+        self._cache_expires = None
+        self._cache_creating = False
+        self._cache_retry_at = None
+        self._lock = threading.Lock()
+        self.totals = {
+            'requests': 0,
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cached_tokens': 0,
+            'over_budget': 0
+        }
+
+    def _get_model(self):
+        """Return the cached-content model when available, else the plain model"""
+        if not self.use_cache:
+            return self.model
+
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            if self._cached_model is not None and now < self._cache_expires:
+                return self._cached_model
+            # Only one thread creates the cache; the others use the plain model meanwhile
+            if self._cache_creating or (self._cache_retry_at and now < self._cache_retry_at):
+                return self.model
+            self._cache_creating = True
+
+        try:
+            cache = caching.CachedContent.create(
+                model=self.model_name,
+                display_name=self.version,
+                system_instruction=self.system_instruction,
+                ttl=self.cache_ttl
+            )
+            cached_model = genai.GenerativeModel.from_cached_content(
+                cached_content=cache,
+                generation_config=self.generation_config
+            )
+        except (google_exceptions.InvalidArgument, google_exceptions.NotFound) as e:
+            # Unsupported model or content below the minimum cacheable size: this
+            # won't change for the life of the process, so stop trying
+            print(f"Context cache unsupported for {self.version}, disabling: {str(e)}")
+            with self._lock:
+                self.use_cache = False
+                self._cache_creating = False
+            return self.model
+        except Exception as e:
+            print(f"Context cache creation failed for {self.version}, will retry: {str(e)}")
+            with self._lock:
+                self._cache_retry_at = now + CACHE_RETRY_DELAY
+                self._cache_creating = False
+            return self.model
+
+        with self._lock:
+            self._cached_model = cached_model
+            # Refresh a little before expiry so in-flight calls never hit a dead cache
+            self._cache_expires = now + self.cache_ttl - timedelta(minutes=1)
+            self._cache_retry_at = None
+            self._cache_creating = False
+        return cached_model
+
+    def generate_content(self, contents):
+        """
+        Generate content and collect token usage
+
+        Args:
+            contents: Per-request contents (text and/or images)
+
+        Returns:
+            tuple: (response, usage dict)
+        """
+        start = time.perf_counter()
+        response = self._get_model().generate_content(contents)
+        latency_ms = round((time.perf_counter() - start) * 1000, 2)
+
+        metadata = getattr(response, 'usage_metadata', None)
+        input_tokens = getattr(metadata, 'prompt_token_count', 0) or 0
+        output_tokens = getattr(metadata, 'candidates_token_count', 0) or 0
+        cached_tokens = getattr(metadata, 'cached_content_token_count', 0) or 0
+
+        usage = {
+            'prompt_version': self.version,
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'cached_tokens': cached_tokens,
+            'total_tokens': input_tokens + output_tokens,
+            'latency_ms': latency_ms
+        }
+        if self.token_budget:
+            usage['token_budget'] = self.token_budget
+            usage['over_budget'] = usage['total_tokens'] > self.token_budget
+
+        with self._lock:
+            self.totals['requests'] += 1
+            self.totals['input_tokens'] += input_tokens
+            self.totals['output_tokens'] += output_tokens
+            self.totals['cached_tokens'] += cached_tokens
+            if usage.get('over_budget'):
+                self.totals['over_budget'] += 1
+
+        return response, usage
+
+    def get_totals(self):
+        """Cumulative token usage for this prompt since startup"""
+        with self._lock:
+            return dict(self.totals, prompt_version=self.version, context_cache=self.use_cache)
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+# PrescriptionOCR and GeminiTranslator live in Flask-server/services.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp'}
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        """
+        Spread calls evenly across worker threads
+
+        Args:
+            rate (float): Maximum calls per second (0 disables limiting)
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+def find_images(input_dir, recursive=False):
+    """
+    Collect prescription images in a directory
+
+    Args:
+        input_dir (str): Directory to walk
+        recursive (bool): Include sub-directories
+
+    Returns:
+        list: Sorted image paths
+    """
+    pattern = '**/*' if recursive else '*'
+    return sorted(
+        p for p in Path(input_dir).glob(pattern)
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+
+def load_checkpoint(output_path):
+    """
+    Read finished files from an existing results file
+
+    Args:
+        output_path (str): JSONL results file
+
+    Returns:
+        set: Image keys that were already processed successfully
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if record.get('success'):
+                done.add(record['file'])
+    return done
+
+
+def format_prescription_text(data):
+    """Render extracted prescription data as plain text for translation/TTS"""
+    lines = []
+    doctor = data.get('doctor') or {}
+    patient = data.get('patient') or {}
+    if doctor.get('name'):
+        lines.append(f"Doctor: {doctor['name']}")
+    if patient.get('name'):
+        lines.append(f"Patient: {patient['name']}")
+    if patient.get('prescription_date'):
+        lines.append(f"Date: {patient['prescription_date']}")
+
+    for i, med in enumerate(data.get('medications') or [], 1):
+        parts = [med.get(k) for k in ('name', 'dosage', 'frequency', 'duration', 'instructions')]
+        lines.append(f"{i}. " + ", ".join(p for p in parts if p))
+
+    notes = data.get('additional_notes') or {}
+    for key in ('special_instructions', 'follow_up', 'warnings'):
+        if notes.get(key):
+            lines.append(f"{key.replace('_', ' ').capitalize()}: {notes[key]}")
+    return "\n".join(lines)
+
+
+class BatchProcessor:
+    def __init__(self, ocr, limiter, translator=None, target_language=None,
+                 tts=None, audio_dir=None, enhance=True):
+        """
+        Process prescription images one at a time (called from worker threads)
+
+        Args:
+            ocr (PrescriptionOCR): OCR instance
+            limiter (RateLimiter): Shared limiter applied to every model call
+            translator (GeminiTranslator): Optional translator
+            target_language (str): Language to translate into
+            tts (GTTSConverter): Optional text-to-speech converter
+            audio_dir (str): Directory for generated audio files
+            enhance (bool): Preprocess images before OCR
+        """
+        self.ocr = ocr
+        self.limiter = limiter
+        self.translator = translator
+        self.target_language = target_language
+        self.tts = tts
+        self.audio_dir = audio_dir
+        self.enhance = enhance
+
+    def process(self, image_path, key):
+        start = time.perf_counter()
+        record = {'file': key}
+
+        self.limiter.wait()
+        result = self.ocr.extract_prescription_details(str(image_path), enhance_image=self.enhance)
+        record.update(result)
+
+        data = result.get('data') or {}
+        if result['success'] and 'raw_response' in data:
+            # Unparsed model output is not a usable result; leave it for the next run
+            record['success'] = False
+            record['error'] = 'Model response could not be parsed as JSON'
+
+        if record['success'] and self.translator:
+            self.limiter.wait()
+            translation = self.translator.translate_text_with_context(
+                text=format_prescription_text(data),
+                target_language=self.target_language,
+                context_info="medical document"
+            )
+            record['translation'] = translation
+            if not translation['success']:
+                record['success'] = False
+                record['error'] = translation['error']
+            elif self.tts:
+                audio_path = os.path.join(self.audio_dir, f"{Path(key).with_suffix('')}.mp3".replace(os.sep, '_'))
+                try:
+                    tts_object = self.tts.convert_text_to_audio(translation['translated_text'], self.target_language)
+                    self.tts.save_audio(tts_object, audio_path)
+                    record['audio_path'] = audio_path
+                except Exception as e:
+                    record['success'] = False
+                    record['error'] = str(e)
+
+        record['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+        return record
+
+
+def run_batch(processor, images, input_dir, output_path, workers):
+    """
+    Run the batch, streaming each result to JSONL as it completes
+
+    Returns:
+        dict: Throughput summary
+    """
+    done = load_checkpoint(output_path)
+    pending = []
+    for path in images:
+        key = str(path.relative_to(input_dir))
+        if key not in done:
+            pending.append((path, key))
+
+    print(f"Found {len(images)} images, {len(images) - len(pending)} already done, {len(pending)} to process")
+
+    summary = {'total': len(images), 'skipped': len(images) - len(pending), 'succeeded': 0, 'failed': 0,
+               'input_tokens': 0, 'output_tokens': 0}
+    latencies = []
+    start = time.perf_counter()
+
+    # Terminate a line left truncated by an interrupted run before appending
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+        if needs_newline:
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write('\n')
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        with open(output_path, 'a', encoding='utf-8') as out:
+            futures = {pool.submit(processor.process, path, key): key for path, key in pending}
+            for i, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {'file': key, 'success': False, 'error': str(e)}
+                record['processed_at'] = datetime.now().isoformat()
+
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+
+                if record.get('success'):
+                    summary['succeeded'] += 1
+                else:
+                    summary['failed'] += 1
+                usage = record.get('usage') or {}
+                summary['input_tokens'] += usage.get('input_tokens', 0)
+                summary['output_tokens'] += usage.get('output_tokens', 0)
+                if 'elapsed_seconds' in record:
+                    latencies.append(record['elapsed_seconds'])
+
+                status = 'ok' if record.get('success') else f"FAILED: {record.get('error')}"
+                print(f"[{i}/{len(pending)}] {key} {status}")
+    except KeyboardInterrupt:
+        print("\nInterrupted - finished files are saved, re-run to resume")
+        summary['interrupted'] = True
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    processed = summary['succeeded'] + summary['failed']
+    summary['elapsed_seconds'] = round(elapsed, 2)
+    summary['images_per_minute'] = round(processed / elapsed * 60, 2) if elapsed > 0 else 0
+    summary['avg_seconds_per_image'] = round(sum(latencies) / len(latencies), 2) if latencies else 0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-process a folder of prescription images")
+    parser.add_argument('input_dir', help="Directory of prescription images")
+    parser.add_argument('-o', '--output', default='batch_results.jsonl',
+                        help="JSONL results file; also used as the resume checkpoint")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="Concurrent workers")
+    parser.add_argument('-r', '--rate', type=float, default=1.0,
+                        help="Maximum model calls per second across all workers (0 = unlimited)")
+    parser.add_argument('--recursive', action='store_true', help="Include sub-directories")
+    parser.add_argument('--no-enhance', action='store_true', help="Skip image preprocessing")
+    parser.add_argument('--translate', metavar='LANGUAGE', help="Also translate each prescription")
+    parser.add_argument('--tts', action='store_true', help="Also generate audio for the translation")
+    parser.add_argument('--audio-dir', default='batch_audio', help="Directory for generated audio")
+    args = parser.parse_args()
+
+    if args.tts and not args.translate:
+        parser.error("--tts requires --translate")
+
+    from dotenv import load_dotenv
+    from services import PrescriptionOCR, GeminiTranslator, model_settings_from_env
+
+    load_dotenv()
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        parser.error("GEMINI_API_KEY not found in environment variables. Please set it in your .env file.")
+
+    # Same prompt caching and token budget settings as the server
+    settings = model_settings_from_env()
+    ocr = PrescriptionOCR(api_key, **settings)
+    translator = GeminiTranslator(api_key, **settings) if args.translate else None
+
+    tts = None
+    if args.tts:
+        from text_to_speech import GTTSConverter
+        tts = GTTSConverter()
+        if args.translate not in tts.get_supported_languages():
+            parser.error(f"TTS does not support {args.translate}. Supported: {tts.get_supported_languages()}")
+
+    processor = BatchProcessor(
+        ocr,
+        RateLimiter(args.rate),
+        translator=translator,
+        target_language=args.translate,
+        tts=tts,
+        audio_dir=args.audio_dir,
+        enhance=not args.no_enhance
+    )
+
+    input_dir = Path(args.input_dir)
+    images = find_images(input_dir, args.recursive)
+    summary = run_batch(processor, images, input_dir, args.output, args.workers)
+
+    print("\nBatch summary")
+    print("=" * 50)
+    for key, value in summary.items():
+        print(f"{key.replace('_', ' ').capitalize()}: {value}")
+    print(f"Results: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import os
+import json
+import copy
+from datetime import datetime
+
+import google.generativeai as genai
+import PIL.Image
+from PIL import ImageEnhance, ImageFilter
+
+from stages import stage
+from prompts import (
+    PromptModel,
+    EXTRACTION_PROMPT_VERSION,
+    EXTRACTION_SYSTEM_INSTRUCTION,
+    EXTRACTION_REQUEST,
+    PROGRESSIVE_EXTRACTION_PROMPT_VERSION,
+    PROGRESSIVE_EXTRACTION_SYSTEM_INSTRUCTION,
+    REFINEMENT_PROMPT_VERSION,
+    REFINEMENT_SYSTEM_INSTRUCTION,
+    REFINEMENT_REQUEST,
+    TRANSLATION_PROMPT_VERSION,
+    TRANSLATION_SYSTEM_INSTRUCTION,
+    build_translation_request
+)
+from progressive import (
+    MEDICATION_FIELDS,
+    crop_medication,
+    downscale_image,
+    find_uncertain_medications,
+    merge_refined_medications
+)
+
+
+def model_settings_from_env():
+    """
+    Read prompt caching and token budget settings from the environment
+
+    GEMINI_CONTEXT_CACHE currently has no effect: the extraction, refinement and
+    translation instructions (~800 tokens or less) are below Gemini's minimum
+    cacheable size, and gemini-2.0-flash-exp does not support context caching, so
+    PromptModel falls back to sending the system instruction with every call.
+    It becomes useful once the instructions grow (e.g. few-shot examples) and a
+    versioned model that supports caching is used.
+
+    Returns:
+        dict: use_cache and token_budget keyword arguments
+    """
+    return {
+        'use_cache': os.getenv('GEMINI_CONTEXT_CACHE', 'false').lower() in ('1', 'true', 'yes'),
+        'token_budget': int(os.getenv('PROMPT_TOKEN_BUDGET', '0')) or None
+    }
+
+
+# Your PrescriptionOCR class
+class PrescriptionOCR:
+    def __init__(self, api_key, use_cache=False, token_budget=None):
+        """Initialize Prescription OCR with API key"""
+        genai.configure(api_key=api_key)
+        self.model = PromptModel(
+            'gemini-2.0-flash-exp',
+            EXTRACTION_SYSTEM_INSTRUCTION,
+            EXTRACTION_PROMPT_VERSION,
+            use_cache=use_cache,
+            token_budget=token_budget
+        )
+        self.first_pass_model = PromptModel(
+            'gemini-2.0-flash-exp',
+            PROGRESSIVE_EXTRACTION_SYSTEM_INSTRUCTION,
+            PROGRESSIVE_EXTRACTION_PROMPT_VERSION,
+            use_cache=use_cache,
+            token_budget=token_budget,
+            # Refinement is driven by the parsed "uncertain" flags, so the reply must be JSON
+            generation_config={'response_mime_type': 'application/json'}
+        )
+        self.refinement_model = PromptModel(
+            'gemini-2.0-flash-exp',
+            REFINEMENT_SYSTEM_INSTRUCTION,
+            REFINEMENT_PROMPT_VERSION,
+            use_cache=use_cache,
+            token_budget=token_budget,
+            generation_config={'response_mime_type': 'application/json'}
+        )
+    
+    def preprocess_image(self, image_path, enhance=True):
+        """Preprocess prescription image for better OCR results"""
+        image = PIL.Image.open(image_path) 
+        
+        if enhance:
+            if image.mode != 'L':
+                image = image.convert('L')
+            
+            enhancer = ImageEnhance.Contrast(image)
+            image = enhancer.enhance(2.0)
+            
+            enhancer = ImageEnhance.Sharpness(image)
+            image = enhancer.enhance(2.0)
+            
+            image = image.filter(ImageFilter.GaussianBlur(radius=0.5))
+        
+        return image
+    
+    def estimate_decoded_size(self, image_path):
+        """
+        Estimate the bytes a decoded image will occupy, from its header only
+
+        Returns:
+            int: width * height * bands, or 0 if the header can't be read
+        """
+        try:
+            with PIL.Image.open(image_path) as image:
+                width, height = image.size
+                return width * height * len(image.getbands())
+        except Exception:
+            # Unreadable images fail later in extraction with a proper error
+            return 0
+    
+    def load_image(self, image_path, enhance=True):
+        """Open (and optionally preprocess) an image, fully decoded in memory"""
+        with stage('preprocess'):
+            if enhance:
+                image = self.preprocess_image(image_path)
+            else:
+                image = PIL.Image.open(image_path)
+                image.load()
+        return image
+    
+    def extract_prescription_details(self, image_path, enhance_image=True):
+        """Extract detailed prescription information from doctor's handwriting"""
+        try:
+            image = self.load_image(image_path, enhance_image)
+            return self.extract_from_image(image, os.path.basename(image_path))
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f"Error processing prescription: {str(e)}"
+            }
+    
+    def extract_from_image(self, image, image_name, model=None):
+        """Extract prescription information from an already loaded image"""
+        model = model or self.model
+        try:
+            with stage('model'):
+                response, usage = model.generate_content([EXTRACTION_REQUEST, image])
+            
+            # Try to parse the JSON response
+            try:
+                json_data = json.loads(response.text.strip())
+                return {
+                    'success': True,
+                    'data': json_data,
+                    'extraction_date': datetime.now().isoformat(),
+                    'image_path': image_name,
+                    'usage': usage
+                }
+            except json.JSONDecodeError:
+                # If JSON parsing fails, return raw text as fallback
+                return {
+                    'success': True,
+                    'data': {
+                        'raw_response': response.text,
+                        'note': 'Could not parse as JSON, returning raw text'
+                    },
+                    'extraction_date': datetime.now().isoformat(),
+                    'image_path': image_name,
+                    'usage': usage
+                }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f"Error processing prescription: {str(e)}"
+            }
+    
+    def get_totals(self):
+        """Cumulative token usage of every extraction model, keyed by role"""
+        return {
+            'extraction': self.model.get_totals(),
+            'first_pass': self.first_pass_model.get_totals(),
+            'refinement': self.refinement_model.get_totals()
+        }
+    
+    def extract_first_pass(self, image, image_name, max_side=1024):
+        """
+        Fast first pass of progressive extraction on a downscaled image
+        
+        Args:
+            image (PIL.Image): Full-resolution (preprocessed) image
+            image_name (str): Name reported in the result
+            max_side (int): Longest side of the downscaled image in pixels
+        
+        Returns:
+            dict: Extraction result with 'pass' and 'uncertain_medications' added
+        """
+        with stage('downscale'):
+            small = downscale_image(image, max_side)
+        
+        result = self.extract_from_image(small, image_name, model=self.first_pass_model)
+        if result['success']:
+            result['pass'] = 'first'
+            result['uncertain_medications'] = find_uncertain_medications(result['data'])
+        return result
+    
+    def refine_uncertain(self, image, result):
+        """
+        Second pass: re-read only the uncertain medications from high-resolution crops
+        
+        Args:
+            image (PIL.Image): Full-resolution (preprocessed) image
+            result (dict): First-pass result from extract_first_pass
+        
+        Returns:
+            dict: Copy of the result with refined medication fields merged in
+        """
+        data = copy.deepcopy(result['data'])
+        medications = data.get('medications') or []
+        
+        contents = [REFINEMENT_REQUEST]
+        unlocated = []
+        for index in result.get('uncertain_medications', []):
+            med = medications[index]
+            first_reading = json.dumps({k: med.get(k) for k in MEDICATION_FIELDS}, ensure_ascii=False)
+            crop = crop_medication(image, med.get('box_2d'))
+            if crop is None:
+                unlocated.append(f"Entry index {index}. First-pass reading: {first_reading}")
+                continue
+            contents.append(f"Entry index {index}. First-pass reading: {first_reading}")
+            contents.append(crop)
+        
+        # Entries without a usable region share a single full-resolution image
+        if unlocated:
+            contents.append("The following entries could not be located; find them in this full image.")
+            contents.extend(unlocated)
+            contents.append(image)
+        
+        response, usage = self.refinement_model.generate_content(contents)
+        refined = json.loads(response.text.strip()).get('medications') or []
+        updated = merge_refined_medications(data, refined, result.get('uncertain_medications', []))
+        
+        refined_result = dict(result)
+        refined_result.update({
+            'data': data,
+            'pass': 'refined',
+            'extraction_date': datetime.now().isoformat(),
+            'refined_medications': updated,
+            'uncertain_medications': find_uncertain_medications(data),
+            'refinement_usage': usage
+        })
+        return refined_result
+
+# GeminiTranslator class
+class GeminiTranslator:
+    def __init__(self, api_key, use_cache=False, token_budget=None):
+        """Initialize Gemini Translator with API key"""
+        genai.configure(api_key=api_key)
+        self.model = PromptModel(
+            'gemini-2.0-flash-exp',
+            TRANSLATION_SYSTEM_INSTRUCTION,
+            TRANSLATION_PROMPT_VERSION,
+            use_cache=use_cache,
+            token_budget=token_budget
+        )
+    
+    def translate_text_with_context(self, text, target_language, context_info=""):
+        """
+        Translate text with additional context for better accuracy
+        
+        Args:
+            text (str): Text to translate
+            target_language (str): Target language
+            context_info (str): Additional context (e.g., "medical document", "technical manual")
+        
+        Returns:
+            dict: Translation result with success status and translated text
+        """
+        try:
+            prompt = build_translation_request(text, target_language, context_info)
+            
+            with stage('model'):
+                response, usage = self.model.generate_content(prompt)
+            translated_text = response.text
+            
+            return {
+                'success': True,
+                'original_text': text,
+                'translated_text': translated_text,
+                'target_language': target_language,
+                'context_info': context_info,
+                'translation_date': datetime.now().isoformat(),
+                'usage': usage
+            }
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f"Error in translation: {str(e)}"
+            }
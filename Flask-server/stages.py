@@ -0,0 +1,24 @@
+import time
+from contextlib import contextmanager
+
+try:
+    from flask import g, has_request_context
+except ImportError:
+    # Offline tools such as scripts/batch_process.py run without Flask installed
+    g = None
+
+    def has_request_context():
+        return False
+
+
+@contextmanager
+def stage(name):
+    """Time a named stage of the current request (no-op outside a request)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            stages = g.get('profile_stages')
+            if stages is not None:
+                stages[name] = round((time.perf_counter() - start) * 1000, 2)